@@ -18,10 +18,15 @@ The separate files can be concatenated later manually.
 """
 
 
+import atexit
+import copy
+import functools
 import hashlib
 import logging
+import logging.handlers
 import os
 import os.path
+import queue
 import resource
 import time
 
@@ -39,6 +44,8 @@ pluginconf = korppluginlib.get_plugin_config(
         "_{hour:02}{min:02}{sec:02}-{pid:06}.log"),
     # Default log level
     LOG_LEVEL = logging.INFO,
+    # If True, write log messages to the log file in a background thread
+    LOG_BACKGROUND_WRITER = True,
     # If True, change the log level to logging.DEBUG if the query parameters in
     # the HTTP request contain "debug=true".
     LOG_ENABLE_DEBUG_PARAM = True,
@@ -75,6 +82,72 @@ pluginconf = korppluginlib.get_plugin_config(
 )
 
 
+# pluginconf.LOG_CATEGORIES and pluginconf.LOG_EXCLUDE_ITEMS as frozensets for
+# fast membership tests
+_LOG_CATEGORIES = (frozenset(pluginconf.LOG_CATEGORIES)
+                   if pluginconf.LOG_CATEGORIES is not None else None)
+_LOG_EXCLUDE_ITEMS = frozenset(pluginconf.LOG_EXCLUDE_ITEMS)
+
+
+def _is_logged(category, item):
+    """Return True if item in category is logged (at a sufficient level)"""
+    return ((_LOG_CATEGORIES is None or category in _LOG_CATEGORIES)
+            and item not in _LOG_EXCLUDE_ITEMS)
+
+
+# Whether the filter_* methods have anything to log with the configured
+# categories and excluded items; if not, they return immediately
+_LOG_RESULT = _is_logged("result", "Hits") or _is_logged("debug", "Result")
+_LOG_CQP = _is_logged("debug", "CQP")
+_LOG_CQP_TIME = (_is_logged("debug", "CQP-output-length")
+                 or _is_logged("debug", "CQP-time")
+                 or _is_logged("times", "CQP-time-total"))
+_LOG_SQL = _is_logged("debug", "SQL")
+
+# Log levels corresponding to the level names accepted by KorpLogger.log
+_LOG_LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "critical": logging.CRITICAL,
+}
+
+
+@functools.lru_cache(maxsize=16)
+def _make_format(value_count):
+    """Return a format string with value_count "%s"s separated by spaces"""
+    return " ".join(value_count * ("%s",))
+
+
+@functools.lru_cache(maxsize=1024)
+def _hash_user(remote_user):
+    """Return the hash of remote_user to be logged as Auth-user
+
+    The hash is cached, as the same users typically make many
+    requests.
+    """
+    return hashlib.md5(remote_user.encode()).hexdigest()
+
+
+def _merge_values(msg, values):
+    """Return msg formatted with values, not raising an exception
+
+    The values of batched items are merged already when logging, so
+    catch formatting errors here, as logging.Handler does, so that they
+    do not fail the request.
+    """
+    if not values:
+        return msg
+    try:
+        return msg % values
+    except Exception:
+        try:
+            return "%s [formatting error; values: %r]" % (msg, values)
+        except Exception:
+            return msg + " [formatting error]"
+
+
 class LevelLoggerAdapter(logging.LoggerAdapter):
 
     """
@@ -101,14 +174,20 @@ class LevelLoggerAdapter(logging.LoggerAdapter):
     def getEffectiveLevel(self):
         return self._level
 
+    def isEnabledFor(self, level):
+        # LoggerAdapter.isEnabledFor delegates to the underlying logger, so
+        # redefine it to compare directly against self._level
+        return level >= self._level
+
     def process(self, msg, kwargs):
         """If the kwargs (passed to a logging method) contain dict
         "extra", its values override those of the instance-level
-        "extra" instead of being discarded."""
-        if "extra" in kwargs:
-            extra = self.extra.copy()
-            extra.update(kwargs["extra"])
-            kwargs["extra"] = extra
+        "extra" instead of being discarded. If "extra" is missing or
+        empty, use the instance-level "extra" as such without copying
+        it."""
+        extra = kwargs.get("extra")
+        if extra:
+            kwargs["extra"] = dict(self.extra, **extra)
         else:
             kwargs["extra"] = self.extra
         return msg, kwargs
@@ -117,16 +196,42 @@ class LevelLoggerAdapter(logging.LoggerAdapter):
         # LoggerAdapter.log calls logger.log, which re-checks isEnabledFor
         # based on the info in logger, so we need to redefine it to use
         # self._level here. The following is a combination of Logger.log and
-        # LoggerAdapter.log, but calling self.isEnabledFor (of LoggerAdapter),
-        # which in turn calls self.getEffectiveLevel (of this class).
+        # LoggerAdapter.log, but comparing the level directly to self._level.
         if not isinstance(level, int):
             if logging.raiseExceptions:
                 raise TypeError("level must be an integer")
             else:
                 return
-        if self.isEnabledFor(level):
-            msg, kwargs = self.process(msg, kwargs)
-            self._log(level, msg, args, **kwargs)
+        if level >= self._level:
+            self._log_unchecked(level, msg, args, kwargs)
+
+    # The methods for individual levels compare the level directly to
+    # self._level and bypass log, as the level is known to be an integer.
+
+    def debug(self, msg, *args, **kwargs):
+        if logging.DEBUG >= self._level:
+            self._log_unchecked(logging.DEBUG, msg, args, kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        if logging.INFO >= self._level:
+            self._log_unchecked(logging.INFO, msg, args, kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        if logging.WARNING >= self._level:
+            self._log_unchecked(logging.WARNING, msg, args, kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        if logging.ERROR >= self._level:
+            self._log_unchecked(logging.ERROR, msg, args, kwargs)
+
+    def critical(self, msg, *args, **kwargs):
+        if logging.CRITICAL >= self._level:
+            self._log_unchecked(logging.CRITICAL, msg, args, kwargs)
+
+    def _log_unchecked(self, level, msg, args, kwargs):
+        """Log msg with args and kwargs at level without checking level"""
+        msg, kwargs = self.process(msg, kwargs)
+        self._log(level, msg, args, **kwargs)
 
 
 class TruncatingLogFormatter(logging.Formatter):
@@ -137,12 +242,39 @@ class TruncatingLogFormatter(logging.Formatter):
     attribute of the LogRecord instance to be formatted or to
     pluginconf.LOG_MESSAGE_DEFAULT_MAX_LEN if it does not exist. If
     the value is <= 0, do not truncate the message.
+
+    If the record has the attribute batch (set by
+    KorpLogger._log_batch), format each of the (level, message,
+    maxlen) triples in it as a separate log message with the other
+    attributes of the record, each on its own line.
+
+    The class also caches the formatted time without milliseconds, so
+    that it is recomputed only when the second changes.
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # Pair (time in whole seconds, formatted time)
+        self._time_cache = (None, None)
 
     def format(self, record):
+        batch = getattr(record, "batch", None)
+        if batch:
+            # Format the items of the batch using a single copy of record
+            item_record = copy.copy(record)
+            item_record.args = None
+            item_record.batch = None
+            default_maxlen = getattr(record, "maxlen",
+                                     pluginconf.LOG_MESSAGE_DEFAULT_MAX_LEN)
+            lines = []
+            for level, msg, maxlen in batch:
+                item_record.levelno = level
+                item_record.levelname = logging.getLevelName(level)
+                item_record.msg = msg
+                item_record.maxlen = (maxlen if maxlen is not None
+                                      else default_maxlen)
+                lines.append(self.format(item_record))
+            return "\n".join(lines)
         maxlen = getattr(record, "maxlen",
                          pluginconf.LOG_MESSAGE_DEFAULT_MAX_LEN)
         result = super().format(record)
@@ -159,18 +291,54 @@ class TruncatingLogFormatter(logging.Formatter):
                       + result[-trunc_tail_len:])
         return result
 
+    def formatTime(self, record, datefmt=None):
+        """Format the time of record, reusing the previous value if the
+        second and datefmt are the same."""
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        secs = int(record.created)
+        cached_secs, formatted = self._time_cache
+        if secs != cached_secs:
+            formatted = time.strftime(self.default_time_format,
+                                      self.converter(record.created))
+            self._time_cache = (secs, formatted)
+        if self.default_msec_format:
+            formatted = self.default_msec_format % (formatted, record.msecs)
+        return formatted
+
+
+class _LazyStr:
+
+    """Object whose string representation is computed only when needed
+
+    The string representation is that of the return value of the
+    function given as the argument to the constructor. An instance can
+    be passed as a value to be logged, so that computing the value is
+    skipped if the item is not logged.
+    """
+
+    __slots__ = ("_func",)
+
+    def __init__(self, func):
+        self._func = func
+
+    def __str__(self):
+        return str(self._func())
+
 
 class KorpLogger(korppluginlib.KorpCallbackPlugin):
 
     """Class containing plugin functions for various mount points"""
 
-    # The class attribute _loggers contains loggers (actually,
-    # LevelLogAdapters) for all the requests being handled by the current
-    # process. Different LevelLogAdapters are needed so that the request id can
-    # be recorded in the log messages, tying the different log messages for a
-    # request, and so that the log level can be adjusted if the request
+    # The logger (actually, LevelLoggerAdapter) and the log data for a request
+    # are stored in the WSGI environment of the request with the keys
+    # _ENV_LOGGER and _ENV_LOGDATA, so that they are freed together with the
+    # request. Different LevelLoggerAdapters are needed so that the request id
+    # can be recorded in the log messages, tying the different log messages
+    # for a request, and so that the log level can be adjusted if the request
     # contains "debug=true".
-    _loggers = dict()
+    _ENV_LOGGER = __name__ + ".logger"
+    _ENV_LOGDATA = __name__ + ".logdata"
 
     def __init__(self):
         """Initialize logging; called only once per process"""
@@ -187,12 +355,46 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
         os.makedirs(logdir, exist_ok=True)
         handler = logging.FileHandler(logfile)
         handler.setFormatter(TruncatingLogFormatter(pluginconf.LOG_FORMAT))
-        self._logger.addHandler(handler)
-        # Storage for request-specific data, such as start times
-        self._logdata = dict()
+        if pluginconf.LOG_BACKGROUND_WRITER:
+            # Only enqueue log records when handling a request and let a
+            # QueueListener thread format them and write them to the file.
+            # (QueueHandler merges the arguments to the message already when
+            # enqueueing, so later changes to logged objects, such as the
+            # result, do not affect the message.)
+            self._file_handler = handler
+            self._queue_handler = logging.handlers.QueueHandler(None)
+            self._logger.addHandler(self._queue_handler)
+            self._listener = None
+            self._start_listener()
+            # If the module is loaded before forking worker processes (as
+            # with a preloading WSGI server), the listener thread does not
+            # exist in the children, so start a new one in each of them
+            os.register_at_fork(after_in_child=self._start_listener)
+            # Write the remaining records at exit
+            atexit.register(self._stop_listener)
+        else:
+            self._logger.addHandler(handler)
 
     # Helper methods
 
+    def _start_listener(self):
+        """Start a QueueListener thread writing to the log file.
+
+        Use a new queue, so that the records enqueued by the parent
+        process before forking are not written twice.
+        """
+        log_queue = queue.SimpleQueue()
+        self._queue_handler.queue = log_queue
+        self._listener = logging.handlers.QueueListener(
+            log_queue, self._file_handler)
+        self._listener.start()
+
+    def _stop_listener(self):
+        """Stop the QueueListener, writing the remaining records."""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
     def _init_logging(self, request, starttime, args):
         """Initialize logging; called once per request (in enter_handler)"""
         request_id = KorpLogger._get_request_id(request)
@@ -211,39 +413,29 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
                 "maxlen": pluginconf.LOG_MESSAGE_DEFAULT_MAX_LEN,
             },
             loglevel)
-        self._loggers[request_id] = logger
-        self._logdata[request_id] = dict()
+        request.environ[KorpLogger._ENV_LOGGER] = logger
+        # Storage for request-specific data, such as start times
+        request.environ[KorpLogger._ENV_LOGDATA] = {
+            # The sum of the times spent in CQP, updated in filter_cqp_output
+            "cqp_time_sum": 0,
+        }
         return logger
 
-    def _end_logging(self, request):
-        """End logging for a request; called once per request in exit_handler"""
-        request_id = KorpLogger._get_request_id(request)
-        del self._loggers[request_id]
-        del self._logdata[request_id]
-
     def _get_logdata(self, request, key, default=None):
         """Get the request-specific log data item for key (with default)"""
-        return self._logdata[KorpLogger._get_request_id(request)].get(
-            key, default)
+        return request.environ[KorpLogger._ENV_LOGDATA].get(key, default)
 
-    def _set_logdata(self, request, key, value, default=None):
-        """Set the request-specific log data item key to value.
+    def _set_logdata(self, request, key, value):
+        """Set the request-specific log data item key to value."""
+        request.environ[KorpLogger._ENV_LOGDATA][key] = value
 
-        If value is a function (of one argument), set the value to the
-        return value of the function called with the existing value
-        (or default if the values does not exist.
-        """
-        request_id = KorpLogger._get_request_id(request)
-        if callable(value):
-            value = value(self._logdata[request_id].get(key, default))
-        self._logdata[request_id][key] = value
+    def _log(self, logger, level, category, item, *values, format=None,
+             maxlen=None, batch=None):
+        """Log item in category with values using logger at level and format
 
-    def _log(self, log_fn, category, item, *values, format=None, maxlen=None):
-        """Log item in category with values using function log_fn and format
-
-        Do not log if pluginconf.LOG_CATEGORIES is not None and it
-        does not contain category, or if pluginconf.LOG_EXCLUDE_ITEMS
-        contains item.
+        Do not log if level is below the level of logger, if
+        pluginconf.LOG_CATEGORIES is not None and it does not contain
+        category, or if pluginconf.LOG_EXCLUDE_ITEMS contains item.
 
         If multiple values are given, each of them gets the format
         specifier "%s", separated by spaces, unless format is
@@ -251,15 +443,37 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
 
         If maxlen is an integer, use the value as the maximum length
         of the log message, overriding the default.
+
+        If batch is a list, append the message to it as a triple
+        (level, message, maxlen) instead of logging it, to be logged
+        later with _log_batch.
         """
-        if (KorpLogger._log_category(category)
-                and item not in pluginconf.LOG_EXCLUDE_ITEMS):
+        # Check the level first, as it is the cheapest test and the one most
+        # likely to fail for the debug-level items
+        if logger.isEnabledFor(level) and _is_logged(category, item):
             if format is None:
-                format = " ".join(len(values) * ("%s",))
-            extra = {}
-            if maxlen is not None:
-                extra["maxlen"] = maxlen
-            log_fn(item + ": " + format, *values, extra=extra)
+                format = _make_format(len(values))
+            msg = item + ": " + format
+            if batch is not None:
+                batch.append((level, _merge_values(msg, values), maxlen))
+                return
+            # The level has already been checked
+            logger._log_unchecked(
+                level, msg, values,
+                {"extra": {"maxlen": maxlen}} if maxlen is not None else {})
+
+    def _log_batch(self, logger, batch):
+        """Log the messages collected to batch by _log as a single record
+
+        The record gets the highest level of the messages in batch.
+        TruncatingLogFormatter formats each message on a line of its
+        own, so the result is the same as if they had been logged
+        separately, but with a single write to the log file.
+        """
+        if batch:
+            logger._log_unchecked(max(level for level, _, _ in batch),
+                                  "\n".join(msg for _, msg, _ in batch),
+                                  (), {"extra": {"batch": batch}})
 
     @staticmethod
     def _get_request_id(request):
@@ -269,39 +483,42 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
     @staticmethod
     def _get_logger(request):
         """Return the logger for request (actual request object, not proxy)"""
-        return KorpLogger._loggers[KorpLogger._get_request_id(request)]
+        return request.environ[KorpLogger._ENV_LOGGER]
 
     @staticmethod
     def _log_category(category):
         """Return True if logging category"""
-        return (pluginconf.LOG_CATEGORIES is None
-                or category in pluginconf.LOG_CATEGORIES)
+        return _LOG_CATEGORIES is None or category in _LOG_CATEGORIES
 
     # Actual plugin methods (functions)
 
     def enter_handler(self, args, starttime, request):
         """Initialize logging at entering Korp and log basic information"""
         logger = self._init_logging(request, starttime, args)
+        # Collect the messages to be logged as a single batch
+        batch = []
+        log = functools.partial(self._log, logger, batch=batch)
         self._set_logdata(request, "cpu_times_start", os.times()[:4])
         env = request.environ
         # request.remote_addr is localhost when behind proxy, so get the
         # originating IP from request.access_route
-        self._log(logger.info, "userinfo", "IP", request.access_route[0])
-        self._log(logger.info, "userinfo", "User-agent", request.user_agent)
-        self._log(logger.info, "referrer", "Referrer", request.referrer)
+        log(logging.INFO, "userinfo", "IP", request.access_route[0])
+        log(logging.INFO, "userinfo", "User-agent", request.user_agent)
+        log(logging.INFO, "referrer", "Referrer", request.referrer)
         # request.script_root is empty; how to get the name of the
         # script? Or is it at all relevant here?
-        # self._log(logger.info, "params", "Script", request.script_root)
-        self._log(logger.info, "params", "Loginfo", args.get("loginfo", ""))
+        # log(logging.INFO, "params", "Script", request.script_root)
+        log(logging.INFO, "params", "Loginfo", args.get("loginfo", ""))
         cmd = request.path.strip("/")
         if not cmd:
             cmd = "info"
         # Would it be better to call this "Endpoint"?
-        self._log(logger.info, "params", "Command", cmd)
-        self._log(logger.info, "params", "Params", args)
+        log(logging.INFO, "params", "Command", cmd)
+        log(logging.INFO, "params", "Params", args)
         # Log user information (Shibboleth authentication only). How could we
         # make this depend on using a Shibboleth plugin?
-        if KorpLogger._log_category("auth"):
+        if (logger.isEnabledFor(logging.INFO)
+                and KorpLogger._log_category("auth")):
             # request.remote_user doesn't seem to work here
             try:
                 remote_user = env["HTTP_REMOTE_USER"]
@@ -310,15 +527,21 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
                 remote_user = None
             if remote_user:
                 auth_domain = remote_user.partition("@")[2]
-                auth_user = hashlib.md5(remote_user.encode()).hexdigest()
+                auth_user = _hash_user(remote_user)
             else:
                 auth_domain = auth_user = None
-            self._log(logger.info, "auth", "Auth-domain", auth_domain)
-            self._log(logger.info, "auth", "Auth-user", auth_user)
-        self._log(logger.debug, "env", "Env", env)
-        self._set_logdata(request, "cqp_time_sum", 0)
-        # self._log(logger.debug, "env", "App",
-        #           repr(korppluginlib.app_globals.app.__dict__))
+            log(logging.INFO, "auth", "Auth-domain", auth_domain)
+            log(logging.INFO, "auth", "Auth-user", auth_user)
+        # Omit the logger and log data stored in env by _init_logging, and
+        # copy env only if it is actually logged
+        log(logging.DEBUG, "env", "Env",
+            _LazyStr(lambda: dict(
+                (key, val) for key, val in env.items()
+                if key not in (KorpLogger._ENV_LOGGER,
+                               KorpLogger._ENV_LOGDATA))))
+        # log(logging.DEBUG, "env", "App",
+        #     repr(korppluginlib.app_globals.app.__dict__))
+        self._log_batch(logger, batch)
 
     def exit_handler(self, endtime, elapsed_time, request):
         """Log information at exiting Korp"""
@@ -332,30 +555,32 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
                     .replace(",", ""))
 
         logger = KorpLogger._get_logger(request)
-        self._log(logger.info, "times", "CQP-time-total",
-                  self._get_logdata(request, "cqp_time_sum"))
-        self._log(logger.info, "load", "CPU-load", *os.getloadavg())
+        batch = []
+        log = functools.partial(self._log, logger, batch=batch)
+        log(logging.INFO, "times", "CQP-time-total",
+            self._get_logdata(request, "cqp_time_sum"))
+        log(logging.INFO, "load", "CPU-load", *os.getloadavg())
         # FIXME: The CPU times probably make little sense, as the WSGI server
         # handles multiple requests in a single process. However, does CPU
         # times difference make any more sense?
         cpu_times_start = self._get_logdata(request, "cpu_times_start")
         cpu_times_end = os.times()[:4]
-        self._log(logger.info, "times", "CPU-times", *cpu_times_end)
+        log(logging.INFO, "times", "CPU-times", *cpu_times_end)
         # The difference of CPU times at the beginning and end of the request
         cpu_times_diff = tuple(
             "{:.2f}".format(cpu_times_end[i] - cpu_times_start[i])
             for i in range(len(cpu_times_start)))
-        self._log(logger.info, "times", "CPU-times-diff", *cpu_times_diff)
+        log(logging.INFO, "times", "CPU-times-diff", *cpu_times_diff)
         rusage_self = resource.getrusage(resource.RUSAGE_SELF)
         rusage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
-        self._log(logger.info, "memory", "Memory-max-RSS",
-                  rusage_self[2], rusage_children[2])
-        self._log(logger.debug, "rusage", "Resource-usage-self",
-                  format_rusage(rusage_self))
-        self._log(logger.debug, "rusage", "Resource-usage-children",
-                  format_rusage(rusage_children))
-        self._log(logger.info, "times", "Elapsed", elapsed_time)
-        self._end_logging(request)
+        log(logging.INFO, "memory", "Memory-max-RSS",
+            rusage_self[2], rusage_children[2])
+        log(logging.DEBUG, "rusage", "Resource-usage-self",
+            format_rusage(rusage_self))
+        log(logging.DEBUG, "rusage", "Resource-usage-children",
+            format_rusage(rusage_children))
+        log(logging.INFO, "times", "Elapsed", elapsed_time)
+        self._log_batch(logger, batch)
 
     def filter_result(self, result, request):
         """Debug log the result (request response)
@@ -363,31 +588,41 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
         Note that the possible filter_result functions of plugins
         loaded before this one have been applied to the result.
         """
+        if not _LOG_RESULT:
+            return
         logger = KorpLogger._get_logger(request)
         if "corpus_hits" in result:
-            self._log(logger.info, "result", "Hits", result["corpus_hits"])
-        self._log(logger.debug, "debug", "Result", result)
+            self._log(logger, logging.INFO, "result", "Hits",
+                      result["corpus_hits"])
+        self._log(logger, logging.DEBUG, "debug", "Result", result)
 
     def filter_cqp_input(self, cqp, request):
         """Debug log CQP input cqp and save start time"""
-        logger = KorpLogger._get_logger(request)
-        self._log(logger.debug, "debug", "CQP", cqp)
-        self._set_logdata(request, "cqp_start_time",  time.time())
+        if _LOG_CQP:
+            logger = KorpLogger._get_logger(request)
+            self._log(logger, logging.DEBUG, "debug", "CQP", cqp)
+        if _LOG_CQP_TIME:
+            self._set_logdata(request, "cqp_start_time", time.time())
 
     def filter_cqp_output(self, output, request):
         """Debug log CQP output length and time spent in CQP"""
-        cqp_time = time.time() - self._get_logdata(request, "cqp_start_time")
+        if not _LOG_CQP_TIME:
+            return
+        logdata = request.environ[KorpLogger._ENV_LOGDATA]
+        cqp_time = time.time() - logdata["cqp_start_time"]
         logger = KorpLogger._get_logger(request)
         # output is a pair (result, error): log the length of both
-        self._log(logger.debug, "debug", "CQP-output-length",
+        self._log(logger, logging.DEBUG, "debug", "CQP-output-length",
                   *(len(val) for val in output))
-        self._log(logger.debug, "debug", "CQP-time", cqp_time)
-        self._set_logdata(request, "cqp_time_sum", lambda x: x + cqp_time, 0)
+        self._log(logger, logging.DEBUG, "debug", "CQP-time", cqp_time)
+        logdata["cqp_time_sum"] += cqp_time
 
     def filter_sql(self, sql, request):
         """Debug log SQL statements sql"""
+        if not _LOG_SQL:
+            return
         logger = KorpLogger._get_logger(request)
-        self._log(logger.debug, "debug", "SQL", sql)
+        self._log(logger, logging.DEBUG, "debug", "SQL", sql)
 
     def log(self, levelname, category, item, value, request):
         """Log with the given level, category, item and value
@@ -402,5 +637,5 @@ class KorpLogger(korppluginlib.KorpCallbackPlugin):
         ...) whenever they wish to log something.
         """
         logger = KorpLogger._get_logger(request)
-        self._log(getattr(logger, levelname, logger.info),
+        self._log(logger, _LOG_LEVELS.get(levelname, logging.INFO),
                   category, item, value)
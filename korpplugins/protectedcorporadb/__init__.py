@@ -6,6 +6,8 @@ Retrieve a list of protected corpora from a MySQL database.
 """
 
 
+import time
+
 import MySQLdb
 
 import korppluginlib
@@ -38,9 +40,29 @@ pluginconf = korppluginlib.get_plugin_config(
     # Whether to keep the database connection persistent or close after each
     # call of filter_protected_corpora
     PERSISTENT_DB_CONNECTION = True,
+    # The number of seconds for which to reuse the list of protected corpora
+    # retrieved from the database; 0 to retrieve it on every call
+    PROTECTED_CORPORA_CACHE_TTL = 60,
 )
 
 
+# The following values depend only on pluginconf, so they are computed once
+# at module load.
+
+# LIST_PROTECTED_CORPORA_SQL with values filled in from other values in
+# pluginconf
+_LIST_PROTECTED_CORPORA_SQL = pluginconf.LIST_PROTECTED_CORPORA_SQL.format(
+    **pluginconf.__dict__)
+
+# Database connection parameters: non-empty DBCONN_PARAMS overrides individual
+# DBCONN_* values
+_CONN_PARAMS = (
+    pluginconf.DBCONN_PARAMS
+    or dict((key.lower().split("_", 1)[1], val)
+            for key, val in pluginconf.__dict__.items()
+            if key.startswith("DBCONN_") and key != "DBCONN_PARAMS"))
+
+
 class ProtectedCorporaDatabase(korppluginlib.KorpCallbackPlugin):
 
     """Callback plugin class for retrieving protected corpora from database"""
@@ -49,25 +71,32 @@ class ProtectedCorporaDatabase(korppluginlib.KorpCallbackPlugin):
         """Initialize but do not connect to the database yet."""
         super().__init__()
         self._connection = None
-        # Fill in values in LIST_PROTECTED_CORPORA_SQL from other values in
-        # pluginconf
-        self._list_protected_corpora_sql = (
-            pluginconf.LIST_PROTECTED_CORPORA_SQL.format(
-                **pluginconf.__dict__))
-        # Non-empty DBCONN_PARAMS overrides individual DBCONN_* values
-        self._conn_params = (
-            pluginconf.DBCONN_PARAMS
-            or dict((key.lower().split("_", 1)[1], val)
-                    for key, val in pluginconf.__dict__.items()
-                    if (key.startswith("DBCONN_")
-                        and key != "DBCONN_PARAMS")))
+        # The cursor is reused as long as the connection is kept
+        self._cursor = None
+        # The protected corpora last retrieved from the database (tuple) and
+        # the time.monotonic() time of retrieving them
+        self._cached_corpora = None
+        self._cached_corpora_time = 0
+        self._list_protected_corpora_sql = _LIST_PROTECTED_CORPORA_SQL
+        self._conn_params = _CONN_PARAMS
 
     def __del__(self):
         """Close connection when deleting the object."""
         self._disconnect()
 
     def filter_protected_corpora(self, protected_corpora, request):
-        """Append to protected_corpora corpora in authorization database."""
+        """Append to protected_corpora corpora in authorization database.
+
+        Reuse the corpora retrieved from the database if they were
+        retrieved at most PROTECTED_CORPORA_CACHE_TTL seconds ago.
+        """
+        now = time.monotonic()
+        if (self._cached_corpora is not None
+                and (now - self._cached_corpora_time
+                     < pluginconf.PROTECTED_CORPORA_CACHE_TTL)):
+            protected_corpora.extend(self._cached_corpora)
+            return protected_corpora
+
         connection_errors = (
             AttributeError,
             MySQLdb.MySQLError,
@@ -76,22 +105,26 @@ class ProtectedCorporaDatabase(korppluginlib.KorpCallbackPlugin):
         )
 
         def db_fetch():
-            with self._connection.cursor() as cursor:
-                cursor.execute(self._list_protected_corpora_sql)
-                return [corpus for corpus, in cursor]
+            self._cursor.execute(self._list_protected_corpora_sql)
+            # Fetch all rows at once, as iterating over a MySQLdb cursor calls
+            # fetchone for each row
+            return tuple(corpus for corpus, in self._cursor.fetchall())
 
         if self._connect():
             try:
-                protected_corpora.extend(db_fetch())
+                corpora = db_fetch()
             except connection_errors:
                 # retry in case connection is in bad state
                 # if we still can't connect, cause exception & handle it in
                 # the caller, which can try to use its cache
                 self._connect(force_reconnect=True)
                 try:
-                    protected_corpora.extend(db_fetch())
+                    corpora = db_fetch()
                 except connection_errors:
                     raise ConnectionError
+            protected_corpora.extend(corpora)
+            self._cached_corpora = corpora
+            self._cached_corpora_time = now
 
         # If the database connection is not persistent, close it
         if not pluginconf.PERSISTENT_DB_CONNECTION:
@@ -100,7 +133,16 @@ class ProtectedCorporaDatabase(korppluginlib.KorpCallbackPlugin):
         return protected_corpora
 
     def _disconnect(self):
-        """Disconnect from authorization database and set self._connection to None."""
+        """Disconnect from authorization database.
+
+        Close self._cursor and self._connection and set them to None.
+        """
+        if self._cursor is not None:
+            try:
+                self._cursor.close()
+            except Exception:
+                pass
+            self._cursor = None
         if self._connection is not None:
             try:
                 self._connection.close()
@@ -113,19 +155,21 @@ class ProtectedCorporaDatabase(korppluginlib.KorpCallbackPlugin):
 
         Connect to the authorization database with parameters
         specified in the DBCONN_* configuration variables. Set
-        self._connection to the connection and return it. If
-        connecting fails, set it to None and return None. If
-        force_reconnect is True, make a connection in any case.
+        self._connection to the connection, self._cursor to a cursor
+        for it and return the connection. If connecting fails, set
+        them to None and return None. If force_reconnect is True, make
+        a connection in any case.
         """
         if force_reconnect:
             self._disconnect()
         if not self._connection:
             try:
                 self._connection = MySQLdb.connect(**self._conn_params)
+                self._cursor = self._connection.cursor()
             except (MySQLdb.MySQLError, MySQLdb.InterfaceError,
                     MySQLdb.DatabaseError) as e:
                 print("korpplugins.protectedcorporadb: Error connecting"
                       " to database:", e)
-                self._connection = None
+                self._disconnect()
                 raise ConnectionError
         return self._connection
@@ -10,29 +10,46 @@ for the Language Bank of Finland, originally by Jussi Piitulainen.
 """
 
 
+import functools
+
 import korppluginlib
 
 
+@functools.lru_cache(maxsize=None)
+def _get_lookup_keys(key):
+    """Return the env variable and header names to try for env variable key.
+
+    Return a pair (env_keys, header_keys), where env_keys contains
+    key and, if key begins with "HTTP_", key without the prefix, and
+    header_keys contains X-Key and Key, where Key is title-cased and
+    with the possible "HTTP_" prefix removed. The result is cached, as
+    the same few keys are looked up for every request.
+    """
+    env_keys = [key]
+    if key.startswith("HTTP_"):
+        key = key[5:]
+        env_keys.append(key)
+    key = key.replace("_", "-").title()
+    return tuple(env_keys), ("X-" + key, key)
+
+
 class ShibbolethAuthorizer(korppluginlib.KorpCallbackPlugin):
 
     """A Korp callback plugin for authentication handling Shibboleth info"""
 
-    # dict to map requests to usernames, for saving a username in
+    # The key in the WSGI environment of a request for saving a username in
     # filter_auth_postdata to be added to the result in filter_result, as
-    # expected by the frontend (plugin).
-    _username = {}
-
-    def exit_handler(self, endtime, elapsed, request):
-        """Remove request username at the end of handling the request."""
-        if request in self._username:
-            del self._username[request]
+    # expected by the frontend (plugin). The value is freed together with the
+    # request.
+    _ENV_USERNAME = __name__ + ".username"
 
     def filter_result(self, result, request):
         """Add "username" to the result of /authenticate."""
         # Note: You cannot specify method applies_to() to restrict to
         # /authenticate, as also other endpoints call authenticate internally.
         if request.endpoint == "authenticate":
-            result["username"] = self._username.get(request)
+            result["username"] = request.environ.get(
+                ShibbolethAuthorizer._ENV_USERNAME)
 
     def filter_auth_postdata(self, postdata, request):
         """If REMOTE_USER is set, return postdata with Shibboleth info.
@@ -53,24 +70,26 @@ class ShibbolethAuthorizer(korppluginlib.KorpCallbackPlugin):
             the corresponding HTTP headers X-Key and Key, where Key is
             title-cased and with the possible "HTTP_" prefix removed.
             """
-            value = request.environ.get(key)
-            if not value:
-                if key.startswith("HTTP_"):
-                    key = key[5:]
-                    value = request.environ.get(key)
-                # Try to get a value from HTTP headers
-                if not value:
-                    key = key.replace("_", "-").title()
-                    value = (request.headers.get("X-" + key)
-                             or request.headers.get(key)
-                             or "")
-            return value
+            env_keys, header_keys = _get_lookup_keys(key)
+            for env_key in env_keys:
+                value = env.get(env_key)
+                if value:
+                    return value
+            # Try to get a value from HTTP headers
+            for header_key in header_keys:
+                value = headers.get(header_key)
+                if value:
+                    return value
+            return ""
+
+        env = request.environ
+        headers = request.headers
 
         # Apache seems to pass the remote user information in the environment
         # variable HTTP_REMOTE_USER
         remote_user = get_value("HTTP_REMOTE_USER")
         # Save the username to be added to the result in filter_result
-        self._username[request] = remote_user
+        request.environ[ShibbolethAuthorizer._ENV_USERNAME] = remote_user
         # print("remote user:", remote_user)
         if remote_user:
             # In which order should we check the affiliation variables?